@@ -1,17 +1,200 @@
-from fastapi import FastAPI, Query, HTTPException
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi import FastAPI, Header, Query, HTTPException, Response
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
 from pytubefix import YouTube
+from pytubefix import extract
+from pytubefix import request as pytube_request
+from pytubefix.cipher import Cipher
+from pytubefix.exceptions import (
+    BotDetection, ExtractError, InterpretationError, RegexMatchError, VideoUnavailable,
+)
+from cachetools import LRUCache, TTLCache
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from urllib.error import HTTPError, URLError
+from urllib.parse import quote
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from functools import lru_cache, partial
+from pathlib import Path
+import asyncio
+import hashlib
+import json
 import os
 import uuid
-import subprocess
 import re
+import requests
+import shutil
+import tempfile
+import threading
 from typing import Dict, List, Optional
 from pydantic import BaseModel
 
-app = FastAPI()
-
 DOWNLOAD_FOLDER = "downloads"
-os.makedirs(DOWNLOAD_FOLDER, exist_ok=True)
+DOWNLOAD_DIR = Path(DOWNLOAD_FOLDER)
+
+# Workers in the dedicated pool for blocking pytubefix downloads, so long
+# transfers can't starve the threadpool Starlette uses for everything else
+DOWNLOAD_POOL_WORKERS = 16
+# Separate small pool for video lookups (and their filesize HEAD probes), so
+# /info stays responsive while long adaptive downloads hold download workers
+LOOKUP_POOL_WORKERS = 4
+
+# Multiply instead of divide when converting byte counts for /formats
+BYTES_TO_MB = 1.0 / (1024 * 1024)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """One-time process setup and teardown shared by every request"""
+    DOWNLOAD_DIR.mkdir(parents=True, exist_ok=True)
+    app.state.download_pool = ThreadPoolExecutor(
+        max_workers=DOWNLOAD_POOL_WORKERS, thread_name_prefix="yt-dl"
+    )
+    app.state.lookup_pool = ThreadPoolExecutor(
+        max_workers=LOOKUP_POOL_WORKERS, thread_name_prefix="yt-lookup"
+    )
+    app.state.session = build_session()
+    pytube_request._execute_request = partial(pooled_execute_request, app.state.session)
+    Cipher.get_sig_function_name = cached_get_sig_function_name
+    Cipher.get_nsig_function_name = cached_get_nsig_function_name
+    Cipher.get_sig = checked_get_sig
+    Cipher.get_nsig = checked_get_nsig
+    yield
+    pytube_request._execute_request = original_execute_request
+    Cipher.get_sig_function_name = original_get_sig_function_name
+    Cipher.get_nsig_function_name = original_get_nsig_function_name
+    Cipher.get_sig = original_get_sig
+    Cipher.get_nsig = original_get_nsig
+    app.state.session.close()
+    # Finished files only live as long as their cache entries
+    result_cache.clear()
+    app.state.download_pool.shutdown(wait=False, cancel_futures=True)
+    app.state.lookup_pool.shutdown(wait=False, cancel_futures=True)
+
+app = FastAPI(lifespan=lifespan)
+
+# Pooled HTTP session for stream downloads - reuses TCP/TLS connections
+# to the googlevideo CDN instead of handshaking on every range request
+def build_session() -> requests.Session:
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=10,
+        pool_maxsize=50,
+        max_retries=Retry(total=3, backoff_factor=0.3)
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    # Match urllib's defaults so YouTube sees the same request shape
+    session.headers["Accept-Encoding"] = "identity"
+    return session
+
+class PooledResponse:
+    """Minimal urlopen-style wrapper around a streamed requests response"""
+
+    def __init__(self, response: requests.Response):
+        self._response = response
+
+    def read(self, amt=None):
+        return self._response.raw.read(amt)
+
+    def info(self):
+        return self._response.headers
+
+original_execute_request = pytube_request._execute_request
+
+def pooled_execute_request(session, url, method=None, headers=None, data=None, timeout=None):
+    """Drop-in replacement for pytubefix.request._execute_request using a pooled session"""
+    base_headers = {"User-Agent": "Mozilla/5.0", "accept-language": "en-US,en"}
+    if headers:
+        base_headers.update(headers)
+    if data and not isinstance(data, bytes):
+        data = bytes(json.dumps(data), encoding="utf-8")
+    if not url.lower().startswith("http"):
+        raise ValueError("Invalid URL")
+    if not isinstance(timeout, (int, float)):
+        timeout = None
+
+    method = method or ("POST" if data else "GET")
+    try:
+        response = session.request(
+            method,
+            url,
+            headers=base_headers,
+            data=data,
+            timeout=timeout,
+            stream=method != "HEAD"
+        )
+    except requests.RequestException as e:
+        # pytubefix retries on URLError wrapping an OSError
+        raise URLError(e)
+
+    if response.status_code >= 400:
+        response.close()
+        raise HTTPError(url, response.status_code, response.reason, response.headers, None)
+    return PooledResponse(response)
+
+# Signature-cipher extraction results per player base.js URL. pytubefix
+# re-parses the player JS for every video; many videos share one revision.
+# Cipher objects are built on executor threads, so every access goes through
+# cipher_lock (held only around the cache op, never the JS parsing)
+cipher_cache: LRUCache = LRUCache(maxsize=16)
+cipher_lock = threading.Lock()
+
+original_get_sig_function_name = Cipher.get_sig_function_name
+original_get_nsig_function_name = Cipher.get_nsig_function_name
+
+def cached_get_sig_function_name(self, js, js_url):
+    """Cipher.get_sig_function_name, memoized per js_url"""
+    with cipher_lock:
+        cached = cipher_cache.get(("sig", js_url))
+    if cached is None:
+        name = original_get_sig_function_name(self, js, js_url)
+        with cipher_lock:
+            cipher_cache[("sig", js_url)] = (name, self._sig_param_val)
+        return name
+    name, self._sig_param_val = cached
+    return name
+
+def cached_get_nsig_function_name(self, js, js_url):
+    """Cipher.get_nsig_function_name, memoized per js_url"""
+    with cipher_lock:
+        cached = cipher_cache.get(("nsig", js_url))
+    if cached is None:
+        name = original_get_nsig_function_name(self, js, js_url)
+        with cipher_lock:
+            cipher_cache[("nsig", js_url)] = (name, self._nsig_param_val)
+        return name
+    name, self._nsig_param_val = cached
+    return name
+
+original_get_sig = Cipher.get_sig
+original_get_nsig = Cipher.get_nsig
+
+def forget_cipher(js_url):
+    """Drop both cached extractions for a player that failed to interpret"""
+    with cipher_lock:
+        cipher_cache.pop(("sig", js_url), None)
+        cipher_cache.pop(("nsig", js_url), None)
+
+def checked_get_sig(self, ciphered_signature):
+    """Cipher.get_sig, dropping the cached extraction if it no longer works"""
+    try:
+        return original_get_sig(self, ciphered_signature)
+    except (ExtractError, InterpretationError):
+        forget_cipher(self.js_url)
+        raise
+
+def checked_get_nsig(self, n):
+    """Cipher.get_nsig, caching the param it narrowed to or recovered"""
+    try:
+        nsig = original_get_nsig(self, n)
+    except (ExtractError, InterpretationError):
+        forget_cipher(self.js_url)
+        raise
+    # get_nsig narrows _nsig_param_val to the working control pair (or
+    # recovers XOR params); keep that so later videos skip the dead branches
+    with cipher_lock:
+        cipher_cache[("nsig", self.js_url)] = (self.nsig_function_name, self._nsig_param_val)
+    return nsig
 
 # Response models
 class VideoInfo(BaseModel):
@@ -37,10 +220,66 @@ class FormatOptionsResponse(BaseModel):
     format_type: str
     options: List[StreamOption]
 
-# Global cache to store YouTube objects temporarily
-video_cache: Dict[str, YouTube] = {}
+# Global cache of {"yt", "info", "audio", "progressive", "adaptive"} entries -
+# the ordered stream lists are resolved once so option ids index them directly
+# (TTL bounds how long stale signature ciphers stay resident; LRU bounds memory)
+# Reads/writes of these caches happen on the event loop thread (blocking
+# pytubefix work on the executors never touches them), so they need no
+# lock - unlike cipher_cache, which pool threads use directly
+video_cache: TTLCache = TTLCache(maxsize=128, ttl=600)
+cache_stats = {"hits": 0, "misses": 0}
 
-def process_youtube_url(url):
+# Recently failed video IDs -> error message, so retries from the UI get an
+# immediate 429 instead of another full round of lookups against YouTube
+failed_cache: TTLCache = TTLCache(maxsize=512, ttl=180)
+
+class ResultCache(TTLCache):
+    """TTLCache of finished downloads that deletes a file once its entry is gone"""
+
+    def __setitem__(self, key, value):
+        old = super().get(key)
+        super().__setitem__(key, value)
+        if old and old[0] != value[0]:
+            remove_file(old[0])
+
+    def popitem(self):
+        key, value = super().popitem()
+        remove_file(value[0])
+        return key, value
+
+    def expire(self, time=None):
+        expired = super().expire(time)
+        for _, value in expired:
+            remove_file(value[0])
+        return expired
+
+    def clear(self):
+        self.expire()
+        for value in list(self.values()):
+            remove_file(value[0])
+        super().clear()
+
+def remove_file(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+# Finished downloads: (cache_id, option_id, format) -> (path, filename, media type, etag)
+result_cache = ResultCache(maxsize=128, ttl=600)
+
+# Retry settings for throttled lookups (429 / bot-check / cipher regex failures)
+MAX_FETCH_ATTEMPTS = 5
+MAX_BACKOFF_SECONDS = 30
+
+# Video ID patterns, compiled once at import
+URL_PATTERNS = [
+    re.compile(r'(?:youtube\.com\/watch\?v=|youtu\.be\/|youtube\.com\/embed\/|youtube\.com\/v\/|youtube\.com\/shorts\/)([a-zA-Z0-9_-]{11})'),
+    re.compile(r'([a-zA-Z0-9_-]{11})')
+]
+
+@lru_cache(maxsize=2048)
+def process_youtube_url(url: str) -> str:
     """Simple URL processing - exactly like Google Colab"""
     url = url.split('?feature=shared')[0]
 
@@ -48,13 +287,8 @@ def process_youtube_url(url):
         return url
 
     # Extract video ID
-    patterns = [
-        r'(?:youtube\.com\/watch\?v=|youtu\.be\/|youtube\.com\/embed\/|youtube\.com\/v\/|youtube\.com\/shorts\/)([a-zA-Z0-9_-]{11})',
-        r'([a-zA-Z0-9_-]{11})'
-    ]
-
-    for pattern in patterns:
-        match = re.search(pattern, url)
+    for pattern in URL_PATTERNS:
+        match = pattern.search(url)
         if match:
             video_id = match.group(1)
             new_url = f"https://www.youtube.com/watch?v={video_id}"
@@ -62,86 +296,303 @@ def process_youtube_url(url):
 
     return url
 
-def get_cached_youtube(cache_id: str) -> Optional[YouTube]:
-    """Get YouTube object from cache"""
-    return video_cache.get(cache_id)
+def get_cached_video(cache_id: str) -> Optional[dict]:
+    """Get YouTube object and its ordered stream lists from cache"""
+    entry = video_cache.get(cache_id)
+    cache_stats["hits" if entry else "misses"] += 1
+    return entry
 
-def cache_youtube(url: str) -> str:
-    """Cache YouTube object - NO DELAYS, NO CLIENT SPECIFICATION"""
-    # Process URL exactly like Google Colab
-    processed_url = process_youtube_url(url)
-    
+def load_youtube(processed_url: str) -> dict:
+    """Blocking: create YouTube object and resolve everything the endpoints read"""
     # Create YouTube object exactly like Google Colab (no client, no delays)
     yt = YouTube(processed_url)
-    
     # Force load streams to test connection
     streams = yt.streams
     
-    cache_id = str(uuid.uuid4())
-    video_cache[cache_id] = yt
+    # Resolve the option lists once - exactly the orderings /formats exposes
+    entry = {
+        "yt": yt,
+        "info": VideoInfo(
+            title=yt.title,
+            author=yt.author,
+            views=yt.views,
+            duration=yt.length,
+            thumbnail=yt.thumbnail_url
+        ),
+        "audio": list(streams.filter(only_audio=True).order_by('abr').desc()),
+        "progressive": list(streams.filter(progressive=True, file_extension='mp4').order_by('resolution').desc()),
+        "adaptive": list(streams.filter(adaptive=True, only_video=True, file_extension='mp4').order_by('resolution').desc())
+    }
+    
+    # Stream.filesize falls back to a HEAD request when the manifest has no
+    # contentLength; resolve (and memoize) it here rather than in /formats
+    for option_type in ("audio", "progressive", "adaptive"):
+        for stream in entry[option_type]:
+            stream.filesize
     
-    # Clean old cache entries (keep only last 10)
-    if len(video_cache) > 10:
-        oldest_key = next(iter(video_cache))
-        del video_cache[oldest_key]
+    return entry
+
+async def fetch_youtube(processed_url: str) -> dict:
+    """Load a video on the lookup pool - backoff only when throttled"""
+    # pytubefix is blocking all the way down (InnerTube calls, node cipher
+    # runners), so keep it off the event loop
+    for attempt in range(MAX_FETCH_ATTEMPTS):
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(app.state.lookup_pool, load_youtube, processed_url)
+        except (HTTPError, RegexMatchError, BotDetection) as e:
+            # Only a 429 is throttling; other HTTP errors won't go away on retry
+            if isinstance(e, HTTPError) and e.code != 429:
+                raise
+            if attempt == MAX_FETCH_ATTEMPTS - 1:
+                raise
+            delay = min(2 ** attempt, MAX_BACKOFF_SECONDS)
+            print(f"⚠️ Fetch attempt {attempt + 1} failed ({e}), retrying in {delay}s")
+            await asyncio.sleep(delay)
+
+async def cache_youtube(url: str) -> str:
+    """Cache YouTube object, short-circuiting videos that recently failed"""
+    # Process URL exactly like Google Colab
+    processed_url = process_youtube_url(url)
+    video_id = extract.video_id(processed_url)
+    
+    failure = failed_cache.get(video_id)
+    if failure:
+        raise HTTPException(status_code=429, detail=failure)
+    
+    try:
+        entry = await fetch_youtube(processed_url)
+    except VideoUnavailable as e:
+        # Bot-check, age-gate, geo-block, private, removed, ... - all known-bad
+        # for a while. Transient network errors and bugs are not cached.
+        failed_cache[video_id] = str(e)
+        raise
+    
+    cache_id = str(uuid.uuid4())
+    video_cache[cache_id] = entry
+    failed_cache.pop(video_id, None)
     
     return cache_id
 
-def merge_video_audio(video_path, audio_path, output_path):
+class SafeTitleTable(dict):
+    """str.translate table that keeps alphanumerics and ' ._-' and drops the rest.
+
+    Entries are filled in lazily per code point, so repeat characters are a
+    C-level dict hit instead of a Python-level isalnum() call.
+    """
+
+    def __missing__(self, codepoint):
+        char = chr(codepoint)
+        value = char if char.isalnum() or char in ' ._-' else None
+        self[codepoint] = value
+        return value
+
+SAFE_TITLE_TABLE = SafeTitleTable()
+
+def safe_filename(title: str) -> str:
+    """Create safe filename - exactly like Google Colab"""
+    return title.translate(SAFE_TITLE_TABLE).strip().replace(' ', '_')[:50]
+
+# Chunk size when relaying FFmpeg output to the client
+STREAM_CHUNK_SIZE = 1 << 16
+# Pipe buffer for FFmpeg stdout so it can run ahead of a slow client
+FFMPEG_PIPE_BUFFER = 1 << 20
+
+# Skip FFmpeg's probing/analysis pass (must come before each -i). Inputs are
+# either downloaded files (merge) or a YouTube audio stream arriving on pipe:0
+# (audio). Both are single-track DASH webm/m4a whose header (EBML tracks /
+# front moov) comes first and fully describes the codec, so 32k is enough to
+# detect the container and no decoding is needed. Pipe input can't seek, so
+# this relies on YouTube never sending a trailing moov for DASH audio.
+FFMPEG_INPUT_ARGS = ['-probesize', '32k', '-analyzeduration', '0', '-fflags', '+nobuffer']
+
+# Muxer args (pipe-friendly) and media type for each audio output extension
+AUDIO_OUTPUTS = {
+    ".mp3": (['-f', 'mp3'], "audio/mpeg"),
+    ".m4a": (['-f', 'ipod', '-movflags', 'frag_keyframe+empty_moov'], "audio/mp4"),
+    ".opus": (['-f', 'opus'], "audio/ogg"),
+}
+
+def merge_command(video_path, audio_path):
     """Merge video and audio using FFmpeg - exactly like Google Colab"""
+    return [
+        'ffmpeg',
+        '-loglevel', 'error',
+        *FFMPEG_INPUT_ARGS, '-i', video_path,
+        *FFMPEG_INPUT_ARGS, '-i', audio_path,
+        '-c:v', 'copy',  # Copy video without re-encoding
+        '-c:a', 'aac',   # Convert audio to AAC
+        '-threads', '0', # Use every core for the audio encode
+        # Fragmented MP4 so it can be written to a pipe
+        '-f', 'mp4',
+        '-movflags', 'frag_keyframe+empty_moov',
+        'pipe:1'
+    ]
+
+def audio_codec_args(stream, audio_format: Optional[str]):
+    """Pick FFmpeg codec args and output extension for an audio download"""
+    if audio_format == "mp3":
+        # Explicit MP3 request - the only case that needs a real re-encode
+        return ['-c:a', 'libmp3lame', '-b:a', '192k', '-ar', '44100'], ".mp3"
+    # YouTube audio is already AAC (mp4) or Opus (webm) - just remux it
+    if 'webm' in stream.mime_type:
+        return ['-c:a', 'copy'], ".opus"
+    return ['-c:a', 'copy'], ".m4a"
+
+def convert_audio_command(input_path, codec_args, ext):
+    """Remux or transcode a downloaded audio stream using FFmpeg"""
+    muxer_args, _ = AUDIO_OUTPUTS[ext]
+    return [
+        'ffmpeg',
+        '-loglevel', 'error',
+        *FFMPEG_INPUT_ARGS, '-i', input_path,
+        '-vn',           # Drop any video track
+        *codec_args,
+        '-threads', '0',
+        *muxer_args,
+        'pipe:1'
+    ]
+
+async def start_ffmpeg(command, pipe_input=False):
+    """Start FFmpeg with its output on a pipe, without blocking the event loop"""
+    return await asyncio.create_subprocess_exec(
+        *command,
+        stdin=asyncio.subprocess.PIPE if pipe_input else asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        limit=FFMPEG_PIPE_BUFFER
+    )
+
+async def feed_ffmpeg(process, input_chunks):
+    """Write input chunks to FFmpeg's stdin, closing it at the end of input"""
     try:
-        merge_command = [
-            'ffmpeg',
-            '-i', video_path,
-            '-i', audio_path,
-            '-c:v', 'copy',  # Copy video without re-encoding
-            '-c:a', 'aac',   # Convert audio to AAC
-            '-y',            # Overwrite output file
-            output_path
-        ]
-
-        result = subprocess.run(merge_command, capture_output=True, text=True, check=True)
-        return True
-    except subprocess.CalledProcessError as e:
-        print(f"❌ FFmpeg merge failed: {e}")
-        if e.stderr:
-            print(f"Error details: {e.stderr}")
+        async for chunk in input_chunks:
+            process.stdin.write(chunk)
+            await process.stdin.drain()
+    finally:
+        await input_chunks.aclose()
+        try:
+            process.stdin.close()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+async def relay_ffmpeg_output(process, description, input_chunks=None):
+    """Yield FFmpeg stdout to the client, raising if FFmpeg or its input fails"""
+    stderr_task = asyncio.create_task(process.stderr.read())
+    feed_task = asyncio.create_task(feed_ffmpeg(process, input_chunks)) if input_chunks else None
+    try:
+        while True:
+            chunk = await process.stdout.read(STREAM_CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+        await process.wait()
+        if feed_task:
+            # A failed upstream download must not pass as a short, valid file
+            await feed_task
+        if process.returncode != 0:
+            print(f"❌ FFmpeg {description} failed with exit code {process.returncode}")
+            stderr = await stderr_task
+            if stderr:
+                print(f"Error details: {stderr.decode(errors='replace')}")
+            raise RuntimeError(f"FFmpeg {description} failed")
+    finally:
+        if process.returncode is None:
+            # Client went away mid-stream
+            process.kill()
+            await process.wait()
+        stderr_task.cancel()
+        if feed_task:
+            feed_task.cancel()
+
+def run_in_download_pool(func, *args, **kwargs):
+    """Run a blocking pytubefix call on the download pool"""
+    loop = asyncio.get_running_loop()
+    return loop.run_in_executor(app.state.download_pool, partial(func, *args, **kwargs))
+
+async def iterate_in_download_pool(iterator):
+    """Drive a blocking chunk iterator on the download pool"""
+    done = object()
+    while True:
+        chunk = await run_in_download_pool(next, iterator, done)
+        if chunk is done:
+            break
+        yield chunk
+
+async def stage_and_relay(chunks, staging_dir, final_path, result_key, result_info):
+    """Yield chunks to the client while writing them to the staging dir.
+
+    Only a complete stream is moved into place (atomically, via os.replace)
+    and registered in result_cache; the staging dir is always removed.
+    """
+    staged_path = os.path.join(staging_dir, "output")
+    try:
+        with open(staged_path, "wb") as fh:
+            async for chunk in chunks:
+                await asyncio.to_thread(fh.write, chunk)
+                yield chunk
+        os.replace(staged_path, final_path)
+        result_cache[result_key] = (str(final_path), *result_info)
+    finally:
+        # Stop the upstream (and any FFmpeg process) if the client went away
+        await chunks.aclose()
+        shutil.rmtree(staging_dir, ignore_errors=True)
+
+# A given (video, option, format) always yields the same bytes, so let
+# browsers and CDNs keep it for a day
+CACHE_CONTROL = "public, max-age=86400"
+
+def download_etag(video_id: str, option_id: str, audio_format: Optional[str]) -> str:
+    """Strong ETag for one download variant"""
+    digest = hashlib.sha1(f"{video_id}:{option_id}:{audio_format}".encode()).hexdigest()
+    return f'"{digest}"'
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Check an If-None-Match header against our ETag"""
+    if not if_none_match:
         return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags
+
+def attachment_headers(filename: str, size: Optional[int] = None) -> Dict[str, str]:
+    """Content-Disposition (and Content-Length when known) for a streamed file"""
+    quoted = quote(filename)
+    if quoted != filename:
+        disposition = f"attachment; filename*=utf-8''{quoted}"
+    else:
+        disposition = f'attachment; filename="{filename}"'
+    headers = {"Content-Disposition": disposition}
+    if size:
+        headers["Content-Length"] = str(size)
+    return headers
 
 @app.get("/")
-def root():
+async def root():
     return {"message": "YouTube Downloader API v3.0 - Google Colab Logic Implementation"}
 
 @app.get("/info", response_model=VideoInfoResponse)
-def get_video_info(url: str = Query(...)):
+async def get_video_info(url: str = Query(...)):
     """Step 1: Get video information using Google Colab logic"""
     try:
-        cache_id = cache_youtube(url)
-        yt = get_cached_youtube(cache_id)
+        cache_id = await cache_youtube(url)
+        # Just inserted - read it directly so it doesn't count as a cache hit
+        entry = video_cache.get(cache_id)
         
-        if not yt:
+        if not entry:
             raise HTTPException(status_code=500, detail="Failed to load video")
         
         # Get basic info
-        info = VideoInfo(
-            title=yt.title,
-            author=yt.author,
-            views=yt.views,
-            duration=yt.length,
-            thumbnail=yt.thumbnail_url
-        )
+        info = entry["info"]
         
         # Check available format types
         available_formats = []
         
         # Check for audio streams
-        audio_streams = yt.streams.filter(only_audio=True)
-        if audio_streams:
+        if entry["audio"]:
             available_formats.append("mp3")
         
         # Check for video streams
-        video_streams = yt.streams.filter(file_extension='mp4')
-        if video_streams:
+        if entry["progressive"] or entry["adaptive"]:
             available_formats.append("mp4")
         
         return VideoInfoResponse(
@@ -150,24 +601,25 @@ def get_video_info(url: str = Query(...)):
             available_formats=available_formats
         )
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching video info: {str(e)}")
 
 @app.get("/formats", response_model=FormatOptionsResponse)
-def get_format_options(cache_id: str = Query(...), format_type: str = Query(...)):
+async def get_format_options(cache_id: str = Query(...), format_type: str = Query(...)):
     """Step 2: Get specific format options using Google Colab logic"""
     try:
-        yt = get_cached_youtube(cache_id)
-        if not yt:
+        entry = get_cached_video(cache_id)
+        if not entry:
             raise HTTPException(status_code=404, detail="Video not found in cache. Please fetch info first.")
         
         options = []
         
         if format_type.lower() == "mp3":
             # Audio options - exactly like Google Colab
-            audio_streams = yt.streams.filter(only_audio=True).order_by('abr').desc()
-            for i, stream in enumerate(audio_streams):
-                size_mb = stream.filesize / (1024*1024) if stream.filesize else 0
+            for i, stream in enumerate(entry["audio"]):
+                size_mb = stream.filesize * BYTES_TO_MB
                 options.append(StreamOption(
                     id=f"audio_{i}",
                     quality=stream.abr or "Unknown",
@@ -178,9 +630,8 @@ def get_format_options(cache_id: str = Query(...), format_type: str = Query(...)
         
         elif format_type.lower() == "mp4":
             # Progressive video options (ready to play) - exactly like Google Colab
-            progressive_streams = yt.streams.filter(progressive=True, file_extension='mp4').order_by('resolution').desc()
-            for i, stream in enumerate(progressive_streams):
-                size_mb = stream.filesize / (1024*1024) if stream.filesize else 0
+            for i, stream in enumerate(entry["progressive"]):
+                size_mb = stream.filesize * BYTES_TO_MB
                 options.append(StreamOption(
                     id=f"progressive_{i}",
                     quality=f"{stream.resolution} ({stream.fps}fps)",
@@ -190,9 +641,8 @@ def get_format_options(cache_id: str = Query(...), format_type: str = Query(...)
                 ))
             
             # Adaptive video options (high quality, requires merging) - exactly like Google Colab
-            adaptive_streams = yt.streams.filter(adaptive=True, only_video=True, file_extension='mp4').order_by('resolution').desc()
-            for i, stream in enumerate(adaptive_streams):
-                size_mb = stream.filesize / (1024*1024) if stream.filesize else 0
+            for i, stream in enumerate(entry["adaptive"]):
+                size_mb = stream.filesize * BYTES_TO_MB
                 # Add estimated audio size
                 estimated_total_mb = size_mb * 1.15
                 options.append(StreamOption(
@@ -215,89 +665,144 @@ def get_format_options(cache_id: str = Query(...), format_type: str = Query(...)
         raise HTTPException(status_code=500, detail=f"Error getting format options: {str(e)}")
 
 @app.get("/download")
-def download_selected(cache_id: str = Query(...), option_id: str = Query(...)):
+async def download_selected(
+    cache_id: str = Query(...),
+    option_id: str = Query(...),
+    audio_format: Optional[str] = Query(None, alias="format"),
+    if_none_match: Optional[str] = Header(None)
+):
     """Step 3: Download using Google Colab logic"""
+    staging_dir = None
     try:
-        yt = get_cached_youtube(cache_id)
-        if not yt:
+        # Identical requests are served from the finished file
+        result_key = (cache_id, option_id, audio_format)
+        # Drop (and delete) anything past its TTL before looking up
+        result_cache.expire()
+        cached_result = result_cache.get(result_key)
+        if cached_result and os.path.exists(cached_result[0]):
+            final_path, filename, media_type, etag = cached_result
+            if etag_matches(if_none_match, etag):
+                return Response(status_code=304, headers={"ETag": etag, "Cache-Control": CACHE_CONTROL})
+            return FileResponse(
+                final_path,
+                filename=filename,
+                media_type=media_type,
+                headers={"ETag": etag, "Cache-Control": CACHE_CONTROL}
+            )
+        
+        entry = get_cached_video(cache_id)
+        if not entry:
             raise HTTPException(status_code=404, detail="Video not found in cache")
         
+        # The client (or a CDN in front of us) already has this variant
+        etag = download_etag(entry["yt"].video_id, option_id, audio_format)
+        if etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers={"ETag": etag, "Cache-Control": CACHE_CONTROL})
+        
         # Parse option_id
         option_type, index = option_id.split('_')
         index = int(index)
         
-        # Create safe filename - exactly like Google Colab
-        safe_title = "".join(c for c in yt.title if c.isalnum() or c in (' ', '.', '_', '-')).strip()
-        safe_title = safe_title.replace(' ', '_')[:50]
+        safe_title = safe_filename(entry["info"].title)
         unique_id = uuid.uuid4().hex[:8]
         
+        # Every request works in its own staging dir, so concurrent requests
+        # never share temp files and partial output is never visible
+        staging_dir = tempfile.mkdtemp(dir=DOWNLOAD_FOLDER)
+        filesize = None
+        
         if option_type == "audio":
-            # Download audio - exactly like Google Colab
-            audio_streams = yt.streams.filter(only_audio=True).order_by('abr').desc()
-            selected_stream = audio_streams[index]
-            
-            file_path = selected_stream.download(output_path=DOWNLOAD_FOLDER)
+            selected_stream = entry["audio"][index]
             
-            # Rename to .mp3 - exactly like Google Colab
-            base, ext = os.path.splitext(file_path)
-            new_file_path = base + ".mp3"
-            os.rename(file_path, new_file_path)
+            # Stream-copy AAC/Opus unless the caller explicitly asked for MP3
+            codec_args, ext = audio_codec_args(selected_stream, audio_format)
+            _, media_type = AUDIO_OUTPUTS[ext]
+            filename = f"{safe_title}{ext}"
             
-            return FileResponse(new_file_path, filename=f"{safe_title}.mp3")
+            # Pipe the audio straight from YouTube into FFmpeg's stdin - no
+            # intermediate file for the source container
+            process = await start_ffmpeg(
+                convert_audio_command('pipe:0', codec_args, ext),
+                pipe_input=True
+            )
+            chunks = relay_ffmpeg_output(
+                process,
+                "audio conversion",
+                iterate_in_download_pool(selected_stream.iter_chunks())
+            )
         
         elif option_type == "progressive":
             # Download progressive video - exactly like Google Colab
-            video_streams = yt.streams.filter(progressive=True, file_extension='mp4').order_by('resolution').desc()
-            selected_stream = video_streams[index]
-            
-            file_path = selected_stream.download(output_path=DOWNLOAD_FOLDER)
+            selected_stream = entry["progressive"][index]
             
-            return FileResponse(file_path, filename=f"{safe_title}_{selected_stream.resolution}.mp4")
+            # Relay chunks straight from YouTube while staging them to disk
+            filesize = selected_stream.filesize
+            media_type = "video/mp4"
+            filename = f"{safe_title}_{selected_stream.resolution}.mp4"
+            chunks = iterate_in_download_pool(selected_stream.iter_chunks())
         
         elif option_type == "adaptive":
             # Download adaptive video - exactly like Google Colab
-            video_streams = yt.streams.filter(adaptive=True, only_video=True, file_extension='mp4').order_by('resolution').desc()
-            selected_video_stream = video_streams[index]
+            selected_video_stream = entry["adaptive"][index]
             
             # Get best audio stream
-            audio_stream = yt.streams.filter(only_audio=True).order_by('abr').desc().first()
-            if not audio_stream:
+            if not entry["audio"]:
                 raise HTTPException(status_code=500, detail="No audio stream found for merging")
+            audio_stream = entry["audio"][0]
             
-            # Download video and audio with temp prefixes - exactly like Google Colab
-            video_path = selected_video_stream.download(
-                output_path=DOWNLOAD_FOLDER,
-                filename_prefix="temp_video_"
+            # Download video and audio concurrently with temp prefixes so the
+            # two writers never share a path
+            stop_downloads = threading.Event()
+            video_task = run_in_download_pool(
+                selected_video_stream.download,
+                output_path=staging_dir,
+                filename_prefix="temp_video_",
+                interrupt_checker=stop_downloads.is_set
             )
-            audio_path = audio_stream.download(
-                output_path=DOWNLOAD_FOLDER,
-                filename_prefix="temp_audio_"
+            audio_task = run_in_download_pool(
+                audio_stream.download,
+                output_path=staging_dir,
+                filename_prefix="temp_audio_",
+                interrupt_checker=stop_downloads.is_set
             )
+            try:
+                video_path, audio_path = await asyncio.gather(video_task, audio_task)
+            except BaseException:
+                # Pool threads can't be cancelled - tell the sibling to stop at
+                # its next chunk and wait for it before the staging dir goes
+                stop_downloads.set()
+                await asyncio.wait([video_task, audio_task])
+                raise
             
-            # Create output filename - exactly like Google Colab
-            output_filename = f"{safe_title}_{selected_video_stream.resolution}.mp4"
-            output_path = os.path.join(DOWNLOAD_FOLDER, output_filename)
-            
-            # Merge with FFmpeg - exactly like Google Colab
-            if merge_video_audio(video_path, audio_path, output_path):
-                # Clean up temporary files - exactly like Google Colab
-                os.remove(video_path)
-                os.remove(audio_path)
-                
-                return FileResponse(output_path, filename=f"{safe_title}_{selected_video_stream.resolution}.mp4")
-            else:
-                raise HTTPException(status_code=500, detail="FFmpeg merge failed")
+            # Merge with FFmpeg and pipe the result straight to the client
+            media_type = "video/mp4"
+            filename = f"{safe_title}_{selected_video_stream.resolution}.mp4"
+            process = await start_ffmpeg(merge_command(video_path, audio_path))
+            chunks = relay_ffmpeg_output(process, "merge")
         
         else:
             raise HTTPException(status_code=400, detail="Invalid option ID")
         
+        final_path = DOWNLOAD_DIR / f"{Path(filename).stem}_{unique_id}{Path(filename).suffix}"
+        headers = attachment_headers(filename, filesize)
+        headers.update({"ETag": etag, "Cache-Control": CACHE_CONTROL})
+        return StreamingResponse(
+            stage_and_relay(chunks, staging_dir, final_path, result_key, (filename, media_type, etag)),
+            media_type=media_type,
+            headers=headers
+        )
+        
     except Exception as e:
+        if staging_dir:
+            shutil.rmtree(staging_dir, ignore_errors=True)
         raise HTTPException(status_code=500, detail=f"Download failed: {str(e)}")
 
 @app.get("/cache")
-def get_cache_info():
+async def get_cache_info():
     """Get current cache status"""
+    lookups = cache_stats["hits"] + cache_stats["misses"]
     return {
         "cached_videos": len(video_cache),
-        "cache_ids": list(video_cache.keys())
+        "cache_ids": list(video_cache.keys()),
+        "hit_rate": round(cache_stats["hits"] / lookups, 3) if lookups else 0.0
     }